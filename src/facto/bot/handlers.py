@@ -1,9 +1,11 @@
+import asyncio
+import functools
 import logging
 import re
-from datetime import datetime
+from datetime import date, datetime
 from telegram import Update
 from telegram.constants import ChatAction
-from telegram.error import BadRequest
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes
 
 from facto.core.enums import ChatMode
@@ -14,6 +16,27 @@ from facto.services.memory import MemoryManager
 logger = logging.getLogger(__name__)
 
 MAX_MESSAGE_LENGTH = 4096
+# Bot API calls allowed in flight at once; a concurrency cap, not a per-second rate limit
+MAX_CONCURRENT_SENDS = 25
+# Bot API limit for a single deleteMessages call
+DELETE_BATCH_SIZE = 100
+
+# Streaming: show the first partial reply after this many characters, then
+# refresh it at most every STREAM_EDIT_INTERVAL seconds
+STREAM_FIRST_EDIT_CHARS = 200
+STREAM_EDIT_INTERVAL = 1.5
+# Telegram clears the typing indicator after about 5 seconds
+TYPING_INTERVAL = 4.0
+
+_JOURNAL_RE = re.compile(r'^/journal(?:@\w+)?[ \t]*\n*')
+_MARKDOWN_CODE_RE = re.compile(r'```.*?```|`[^`]*`', re.DOTALL)
+
+FINALIZE_MESSAGE = "I'm satisfied with the current version. Please finalize it now."
+
+# Replies that accept a draft, and the questions the JOURNAL prompt ends drafts with.
+# Both questions ask whether the user wants changes, so "yes" means revise, "no" means accept.
+_SATISFIED = frozenset({"ok", "okay", "no", "nope", "looks good", "perfect", "done", "no changes", "finalize"})
+_DRAFT_QUESTIONS = ("Any other changes?", "Would you like any changes or corrections?")
 
 
 def _split_message(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> list[str]:
@@ -22,36 +45,56 @@ def _split_message(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> list[str]
         return [text]
 
     chunks = []
-    while text:
-        if len(text) <= max_length:
-            chunks.append(text)
+    pos = 0
+    n = len(text)
+    while pos < n:
+        end = pos + max_length
+        if end >= n:
+            chunks.append(text[pos:])
             break
 
-        split_at = max_length
-        newline_pos = text.rfind('\n', 0, max_length)
-        if newline_pos > max_length // 2:
+        split_at = end
+        newline_pos = text.rfind('\n', pos, end)
+        if newline_pos - pos > max_length // 2:
             split_at = newline_pos + 1
         else:
-            space_pos = text.rfind(' ', 0, max_length)
-            if space_pos > max_length // 2:
+            space_pos = text.rfind(' ', pos, end)
+            if space_pos - pos > max_length // 2:
                 split_at = space_pos + 1
 
-        chunks.append(text[:split_at])
-        text = text[split_at:]
+        chunks.append(text[pos:split_at])
+        pos = split_at
 
     return chunks
 
 
+def _is_valid_markdown(text: str) -> bool:
+    """Check that legacy Markdown delimiters are balanced, which Telegram requires to parse."""
+    # Delimiters inside code spans and blocks are literal
+    text = _MARKDOWN_CODE_RE.sub('', text)
+    if '`' in text:
+        return False
+    return text.count('*') % 2 == 0 and text.count('_') % 2 == 0
+
+
 def _get_date_suffix(day: int) -> str:
     if 11 <= day <= 13:
         return "th"
     return {1: "st", 2: "nd", 3: "rd"}.get(day % 10, "th")
 
 
+@functools.lru_cache(maxsize=8)
+def _format_date(ymd: tuple[int, int, int]) -> str:
+    """Format a date like "9th September, Tuesday"; cached per day."""
+    day = date(*ymd)
+    return f"{day.day}{_get_date_suffix(day.day)} {day.strftime('%B, %A')}"
+
+
 class TelegramBotHandlers:
     def __init__(self, ai_service: AIService, memory_manager: MemoryManager):
         self.ai_service = ai_service
         self.memory = memory_manager
+        self._send_sem = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
 
     async def journal_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Process diary entry with journal formatting in a conversational topic flow."""
@@ -61,7 +104,7 @@ class TelegramBotHandlers:
         logger.info(f"Journal command triggered by user {update.effective_user.id}")
 
         full_text = update.message.text or ""
-        match = re.match(r'^/journal(?:@\w+)?[ \t]*\n*', full_text)
+        match = _JOURNAL_RE.match(full_text)
         if match:
             diary_text = full_text[match.end():]
         else:
@@ -82,14 +125,13 @@ class TelegramBotHandlers:
             return
 
         now = datetime.now()
-        day_suffix = _get_date_suffix(now.day)
-        current_date = now.strftime(f"%d{day_suffix} %B, %A").lstrip("0").replace(f"0{day_suffix}", day_suffix)
+        current_date = _format_date((now.year, now.month, now.day))
 
         chat_id = update.effective_chat.id
-        self.memory.set_chat_mode(chat_id, ChatMode.JOURNAL)
+        await self.memory.set_chat_mode(chat_id, ChatMode.JOURNAL)
 
-        diary_with_date = f"Today's date is: {current_date}\n\nMy diary entry:\n{diary_text}"
-        await self._create_topic_flow(update, context, diary_with_date)
+        diary_entry = f"My diary entry:\n{diary_text}"
+        await self._create_topic_flow(update, context, diary_entry, date_str=current_date)
 
     async def done_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Finalize the current conversation and close the topic."""
@@ -103,13 +145,14 @@ class TelegramBotHandlers:
             await update.message.reply_text("This command only works inside a topic.")
             return
 
-        if not self.memory.is_conversation_active(thread_id):
+        if not await self.memory.is_conversation_active(thread_id):
             await update.message.reply_text("No active conversation in this topic.")
             return
 
         self.memory.mark_message_for_deletion(thread_id, update.message.message_id)
-        self.memory.add_message(thread_id, "user", "I'm satisfied with the current version. Please finalize it now.")
-        await self._process_ai_response(chat_id, thread_id, context)
+        async with self.memory.lock(thread_id):
+            await self.memory.add_message(thread_id, "user", FINALIZE_MESSAGE)
+            await self._process_ai_response(chat_id, thread_id, context)
 
     async def delete_topic(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Delete the current topic."""
@@ -123,11 +166,11 @@ class TelegramBotHandlers:
             await update.message.reply_text("This command only works inside a topic.")
             return
 
-        msg_ids = self.memory.get_messages_to_delete(thread_id)
+        msg_ids = await self.memory.get_messages_to_delete(thread_id)
         if msg_ids:
             context.application.create_task(self._delete_history(context.bot, chat_id, msg_ids))
 
-        self.memory.end_conversation(thread_id)
+        await self.memory.end_conversation(thread_id)
 
         try:
             await context.bot.delete_message(chat_id=chat_id, message_id=update.message.message_id)
@@ -143,17 +186,36 @@ class TelegramBotHandlers:
 
         thread_id = update.message.message_thread_id
 
-        if thread_id is None or not self.memory.is_conversation_active(thread_id):
+        if thread_id is None or not await self.memory.is_conversation_active(thread_id):
             return
 
         chat_id = update.effective_chat.id
         user_input = update.message.text
-
         self.memory.mark_message_for_deletion(thread_id, update.message.message_id)
-        self.memory.add_message(thread_id, "user", user_input)
-        await self._process_ai_response(chat_id, thread_id, context)
 
-    async def _create_topic_flow(self, update: Update, context: ContextTypes.DEFAULT_TYPE, question: str):
+        # One turn at a time per topic, so replies land in history in order
+        async with self.memory.lock(thread_id):
+            if await self._is_draft_accepted(thread_id, user_input):
+                # Same as /done: ask for the final version directly
+                user_input = FINALIZE_MESSAGE
+
+            await self.memory.add_message(thread_id, "user", user_input)
+            await self._process_ai_response(chat_id, thread_id, context)
+
+    async def _is_draft_accepted(self, thread_id, user_input):
+        if user_input.strip().lower().rstrip(".!") not in _SATISFIED:
+            return False
+
+        conversation = await self.memory.get_conversation(thread_id)
+        if not conversation or not conversation.history:
+            return False
+
+        last = conversation.history[-1]
+        return last["role"] == "assistant" and last["content"].rstrip().endswith(_DRAFT_QUESTIONS)
+
+    async def _create_topic_flow(
+        self, update: Update, context: ContextTypes.DEFAULT_TYPE, question: str, date_str: str | None = None
+    ):
         chat_id = update.effective_chat.id
         user = update.effective_user
 
@@ -163,55 +225,51 @@ class TelegramBotHandlers:
             topic = await context.bot.create_forum_topic(chat_id=chat_id, name=topic_name)
             thread_id = topic.message_thread_id
 
-            current_mode = self.memory.get_chat_mode(chat_id)
-            initial_history = [
-                {"role": "system", "content": get_system_prompt(current_mode)},
-                {"role": "user", "content": question}
-            ]
-            self.memory.start_conversation(thread_id, initial_history)
+            async with self.memory.lock(thread_id):
+                current_mode = self.memory.get_chat_mode(chat_id)
+                initial_history = [
+                    {"role": "system", "content": get_system_prompt(current_mode, date_str=date_str)},
+                    {"role": "user", "content": question}
+                ]
+                await self.memory.start_conversation(thread_id, initial_history)
 
-            welcome_msg = await context.bot.send_message(
-                chat_id=chat_id,
-                message_thread_id=thread_id,
-                text=f"Hi {user.mention_html()}! Processing your journal entry...",
-                parse_mode="HTML"
-            )
-            self.memory.mark_message_for_deletion(thread_id, welcome_msg.message_id)
+                welcome_msg = await context.bot.send_message(
+                    chat_id=chat_id,
+                    message_thread_id=thread_id,
+                    text=f"Hi {user.mention_html()}! Processing your journal entry...",
+                    parse_mode="HTML"
+                )
+                self.memory.mark_message_for_deletion(thread_id, welcome_msg.message_id)
 
-            await self._process_ai_response(chat_id, thread_id, context)
+                await self._process_ai_response(chat_id, thread_id, context)
 
         except Exception as e:
             logger.error(f"Error creating topic: {e}")
             await update.message.reply_text("Error: I need 'Manage Topics' admin rights.")
 
     async def _process_ai_response(self, chat_id, thread_id, context):
-        await context.bot.send_chat_action(chat_id=chat_id, message_thread_id=thread_id, action=ChatAction.TYPING)
+        bot = context.bot
+        await bot.send_chat_action(chat_id=chat_id, message_thread_id=thread_id, action=ChatAction.TYPING)
+        typing_task = asyncio.create_task(self._keep_typing(bot, chat_id, thread_id))
 
         try:
-            conversation = self.memory.get_conversation(thread_id)
+            conversation = await self.memory.get_conversation(thread_id)
             if not conversation:
                 return
 
-            messages = conversation.history.copy()
-            ai_reply = self.ai_service.get_response(messages)
+            # Callers hold the thread lock, and compaction replaces the list rather
+            # than editing it, so the history cannot change under the request
+            ai_reply, placeholder = await self._stream_reply(bot, chat_id, thread_id, conversation.history)
+            typing_task.cancel()
 
-            self.memory.add_message(thread_id, "assistant", ai_reply)
+            await self.memory.add_message(thread_id, "assistant", ai_reply)
 
+            # Chunks of one reply are sent in order; the semaphore only bounds
+            # how many sends run across all conversations at once.
             chunks = _split_message(ai_reply)
-            for chunk in chunks:
-                try:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        message_thread_id=thread_id,
-                        text=chunk,
-                        parse_mode="Markdown"
-                    )
-                except Exception:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        message_thread_id=thread_id,
-                        text=chunk
-                    )
+            await self._deliver_chunk(bot, chat_id, thread_id, chunks[0], message=placeholder)
+            for chunk in chunks[1:]:
+                await self._deliver_chunk(bot, chat_id, thread_id, chunk)
 
         except Exception as e:
             logger.error(f"AI Error: {e}")
@@ -220,10 +278,120 @@ class TelegramBotHandlers:
                 message_thread_id=thread_id,
                 text="An error occurred while communicating with the AI."
             )
+        finally:
+            typing_task.cancel()
 
-    async def _delete_history(self, bot, chat_id, msg_ids):
-        for mid in msg_ids:
+    async def _keep_typing(self, bot, chat_id, thread_id):
+        while True:
+            await asyncio.sleep(TYPING_INTERVAL)
             try:
-                await bot.delete_message(chat_id=chat_id, message_id=mid)
+                await bot.send_chat_action(chat_id=chat_id, message_thread_id=thread_id, action=ChatAction.TYPING)
             except Exception:
                 pass
+
+    async def _stream_reply(self, bot, chat_id, thread_id, messages):
+        """Stream the AI reply into a placeholder message and return the full text with that message."""
+        loop = asyncio.get_running_loop()
+        parts = []
+        length = 0
+        shown = 0
+        placeholder = None
+        last_edit = loop.time()
+        interval = STREAM_EDIT_INTERVAL
+
+        async for delta in self.ai_service.stream_response(messages):
+            parts.append(delta)
+            length += len(delta)
+
+            # Partial Markdown rarely parses, so previews are sent as plain text
+            if shown >= MAX_MESSAGE_LENGTH:
+                continue
+            now = loop.time()
+            if placeholder is None and length < STREAM_FIRST_EDIT_CHARS and now - last_edit < interval:
+                continue
+            if placeholder is not None and now - last_edit < interval:
+                continue
+
+            preview = "".join(parts)[:MAX_MESSAGE_LENGTH]
+            try:
+                if placeholder is None:
+                    placeholder = await self._send_preview(
+                        bot.send_message, chat_id=chat_id, message_thread_id=thread_id, text=preview
+                    )
+                else:
+                    await self._send_preview(
+                        bot.edit_message_text,
+                        chat_id=placeholder.chat_id,
+                        message_id=placeholder.message_id,
+                        text=preview
+                    )
+                shown = length
+            except RetryAfter as e:
+                # Previews are best-effort: skip this one and back off rather than stall the stream
+                interval = max(interval * 2, e.retry_after)
+                logger.warning(f"Flood control on stream preview, next update in {interval}s")
+            last_edit = now
+
+        return "".join(parts), placeholder
+
+    async def _deliver_chunk(self, bot, chat_id, thread_id, text, message=None):
+        """Send text as a new message, or into an existing one, preferring Markdown."""
+        parse_mode = "Markdown" if _is_valid_markdown(text) else None
+        try:
+            if message is None:
+                await self._send_chunk(bot, chat_id, thread_id, text, parse_mode=parse_mode)
+            else:
+                await self._edit_chunk(bot, message, text, parse_mode=parse_mode)
+        except Exception:
+            if parse_mode is None:
+                raise
+            if message is None:
+                await self._send_chunk(bot, chat_id, thread_id, text)
+            else:
+                await self._edit_chunk(bot, message, text)
+
+    async def _call_with_retry(self, method, **kwargs):
+        """Call a Bot API method under the send semaphore, waiting out flood control."""
+        while True:
+            async with self._send_sem:
+                try:
+                    return await method(**kwargs)
+                except RetryAfter as e:
+                    retry_after = e.retry_after
+            logger.warning(f"Flood control exceeded, retrying in {retry_after}s")
+            await asyncio.sleep(retry_after)
+
+    async def _send_preview(self, method, **kwargs):
+        """Call a Bot API method once under the send semaphore; RetryAfter is left to the caller."""
+        async with self._send_sem:
+            return await method(**kwargs)
+
+    async def _send_chunk(self, bot, chat_id, thread_id, text, parse_mode=None):
+        return await self._call_with_retry(
+            bot.send_message,
+            chat_id=chat_id,
+            message_thread_id=thread_id,
+            text=text,
+            parse_mode=parse_mode
+        )
+
+    async def _edit_chunk(self, bot, message, text, parse_mode=None):
+        try:
+            return await self._call_with_retry(
+                bot.edit_message_text,
+                chat_id=message.chat_id,
+                message_id=message.message_id,
+                text=text,
+                parse_mode=parse_mode
+            )
+        except BadRequest as e:
+            # Editing to identical content is rejected; the message already shows it
+            if "not modified" not in str(e).lower():
+                raise
+
+    async def _delete_history(self, bot, chat_id, msg_ids):
+        batches = [msg_ids[i:i + DELETE_BATCH_SIZE] for i in range(0, len(msg_ids), DELETE_BATCH_SIZE)]
+        await asyncio.gather(
+            *(self._call_with_retry(bot.delete_messages, chat_id=chat_id, message_ids=batch) for batch in batches),
+            return_exceptions=True
+        )
@@ -9,6 +9,8 @@ class Config:
     openai_base_url: str
     model_name: str
     mongodb_uri: str = ""
+    webhook_url: str = ""
+    webhook_port: int = 8443
 
     @classmethod
     def from_env(cls) -> "Config":
@@ -26,4 +28,6 @@ class Config:
             openai_base_url=os.getenv("OPENAI_BASE_URL", "https://api.deepseek.com"),
             model_name=os.getenv("MODEL_NAME", "deepseek-chat"),
             mongodb_uri=os.getenv("MONGODB_URI", ""),
+            webhook_url=os.getenv("PUBLIC_URL", ""),
+            webhook_port=int(os.getenv("PORT", "8443")),
         )
@@ -1,3 +1,5 @@
+import functools
+
 from .enums import ChatMode
 
 SYSTEM_PROMPTS = {
@@ -45,6 +47,15 @@ Remember: Only wrap in ```markdown when user confirms they're satisfied. Until t
 """
 }
 
+SUMMARY_PROMPT = """Summarize the earlier part of a conversation between a user and a journal writing coach.
+Keep every fact from the user's original diary entry and every correction or preference they asked for.
+Be concise. Return ONLY the summary, nothing else."""
+
 
-def get_system_prompt(mode: ChatMode) -> str:
-    return SYSTEM_PROMPTS.get(mode, SYSTEM_PROMPTS[ChatMode.JOURNAL])
+@functools.lru_cache(maxsize=8)
+def get_system_prompt(mode: ChatMode, date_str: str | None = None) -> str:
+    prompt = SYSTEM_PROMPTS.get(mode, SYSTEM_PROMPTS[ChatMode.JOURNAL])
+    if date_str:
+        # Appended last so the rubric stays a byte-identical prefix for provider prompt caching
+        prompt = f"{prompt}\n---\nToday's date is: {date_str}"
+    return prompt
@@ -26,13 +26,34 @@ def main():
 
     # 2. Initialize Services
     ai_service = AIService(config)
-    memory_manager = MemoryManager(mongodb_uri=config.mongodb_uri)
+    memory_manager = MemoryManager(mongodb_uri=config.mongodb_uri, summarizer=ai_service.summarize)
 
     # 3. Initialize Bot Handlers
     handlers = TelegramBotHandlers(ai_service, memory_manager)
 
+    async def post_init(application: Application):
+        await memory_manager.initialize()
+
+    async def post_shutdown(application: Application):
+        await memory_manager.close()
+
     # 4. Build Application
-    application = Application.builder().token(config.telegram_bot_token).build()
+    application = (
+        Application.builder()
+        .token(config.telegram_bot_token)
+        # Serve conversations in parallel; per-topic locks keep each topic's turns in order
+        .concurrent_updates(64)
+        # HTTP/2 lets concurrent Bot API calls share one connection
+        .http_version("2")
+        .get_updates_http_version("2")
+        .connection_pool_size(64)
+        .pool_timeout(10)
+        .connect_timeout(5)
+        .read_timeout(30)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # 5. Register Handlers
     # Journal command
@@ -52,7 +73,17 @@ def main():
     logger.info("Facto Journal Bot starting...")
     logger.info("Commands: /journal, /done, /delete")
 
-    application.run_polling(allowed_updates=["message"])
+    if config.webhook_url:
+        # Telegram pushes updates as they happen instead of waiting on a poll cycle
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=config.webhook_port,
+            url_path=config.telegram_bot_token,
+            webhook_url=f"{config.webhook_url.rstrip('/')}/{config.telegram_bot_token}",
+            allowed_updates=["message"]
+        )
+    else:
+        application.run_polling(allowed_updates=["message"])
 
 
 if __name__ == "__main__":
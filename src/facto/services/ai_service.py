@@ -1,31 +1,66 @@
+from typing import AsyncIterator
+
 import httpx
-from openai import OpenAI
+from openai import AsyncOpenAI
 from facto.config import Config
+from facto.core.prompts import SUMMARY_PROMPT
+
+
+def _service_error(e: Exception) -> RuntimeError:
+    if isinstance(e, httpx.TimeoutException):
+        return RuntimeError(f"AI Service Timeout: The AI took too long to respond. Please try again.")
+    if isinstance(e, httpx.ConnectError):
+        return RuntimeError(f"AI Service Connection Error: Could not connect to AI service. Please try again.")
+    return RuntimeError(f"AI Service Error: {e}")
+
 
 class AIService:
     def __init__(self, config: Config):
         # Configure longer timeout for slow APIs
-        self.client = OpenAI(
+        self.client = AsyncOpenAI(
             api_key=config.deepseek_api_key,
             base_url=config.openai_base_url,
             timeout=httpx.Timeout(120.0, connect=30.0),  # 120s total, 30s connect
-            max_retries=3
+            max_retries=3,
+            http_client=httpx.AsyncClient(http2=True, limits=httpx.Limits(max_connections=64))
         )
         self.model_name = config.model_name
 
-    def get_response(self, messages: list[dict]) -> str:
+    async def get_response(self, messages: list[dict]) -> str:
         """
         Sends the conversation history to the LLM and returns the content of the response.
         """
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model_name,
                 messages=messages
             )
             return response.choices[0].message.content
-        except httpx.TimeoutException as e:
-            raise RuntimeError(f"AI Service Timeout: The AI took too long to respond. Please try again.") from e
-        except httpx.ConnectError as e:
-            raise RuntimeError(f"AI Service Connection Error: Could not connect to AI service. Please try again.") from e
         except Exception as e:
-            raise RuntimeError(f"AI Service Error: {e}") from e
+            raise _service_error(e) from e
+
+    async def stream_response(self, messages: list[dict]) -> AsyncIterator[str]:
+        """
+        Streams the LLM response for the conversation history, yielding content as it is generated.
+        """
+        try:
+            stream = await self.client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            raise _service_error(e) from e
+
+    async def summarize(self, messages: list[dict]) -> str:
+        """
+        Condenses older conversation turns into a short summary used in their place.
+        """
+        transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        return await self.get_response([
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript}
+        ])
@@ -1,80 +1,296 @@
+import asyncio
 import logging
-from typing import Dict, List, Optional
+from typing import Awaitable, Callable, Dict, List, Optional, Set
 from dataclasses import dataclass, field
+from cachetools import LRUCache
 from facto.core.enums import ChatMode
 
 logger = logging.getLogger(__name__)
 
+# How long appended messages may sit in the write-behind buffer
+FLUSH_INTERVAL = 0.5
+
+# Once more than MAX_TURNS messages follow the system prompt, older ones are
+# summarized down to COMPACT_KEEP, leaving room to grow before the next pass
+MAX_TURNS = 20
+COMPACT_KEEP = MAX_TURNS // 2
+
+# Conversations kept in memory when MongoDB is available; the rest load on demand
+CONVERSATION_CACHE_SIZE = 1024
+
+# Fields read back from a conversation document
+_CONVERSATION_PROJECTION = {"_id": 0, "thread_id": 1, "history": 1, "msg_ids_to_delete": 1}
+
+Summarizer = Callable[[List[Dict[str, str]]], Awaitable[str]]
+
 
 @dataclass
 class ConversationState:
     history: List[Dict[str, str]]
-    msg_ids_to_delete: List[int] = field(default_factory=list)
+    msg_ids_to_delete: Set[int] = field(default_factory=set)
+
+
+class _ConversationCache(LRUCache):
+    """LRU cache that hands evicted conversations back to the manager so they can be persisted."""
+
+    def __init__(self, maxsize: int, on_evict: Callable[[int, ConversationState], None]):
+        super().__init__(maxsize)
+        self._on_evict = on_evict
+
+    def popitem(self):
+        thread_id, conv = super().popitem()
+        self._on_evict(thread_id, conv)
+        return thread_id, conv
 
 
 class MemoryManager:
-    def __init__(self, mongodb_uri: str = None, database_name: str = "facto"):
+    def __init__(self, mongodb_uri: str = None, database_name: str = "facto", summarizer: Summarizer = None):
         self._conversations: Dict[int, ConversationState] = {}
         self._chat_modes: Dict[int, ChatMode] = {}
+        # Thread ids with a conversation, cached or not; misses need no lookup
+        self._active_threads: Set[int] = set()
+
+        # Evicted conversations whose final write has not completed yet
+        self._evicted: Dict[int, ConversationState] = {}
+        self._eviction_tasks: set[asyncio.Task] = set()
 
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._summarizer = summarizer
+        self._compacting: set[int] = set()
+        self._compaction_tasks: set[asyncio.Task] = set()
+
+        self._client = None
         self._collection = None
         self._modes_collection = None
 
+        # Write-behind buffer: appends not yet pushed to MongoDB, keyed by thread_id
+        self._pending_messages: Dict[int, List[Dict[str, str]]] = {}
+        self._pending_deletions: Dict[int, List[int]] = {}
+        self._dirty: set[int] = set()
+        # Threads whose last flush had an unknown outcome; their next write is a full $set
+        self._needs_rewrite: set[int] = set()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
         if mongodb_uri:
             try:
-                from pymongo import MongoClient
-                client = MongoClient(mongodb_uri)
-                db = client[database_name]
+                from motor.motor_asyncio import AsyncIOMotorClient
+                self._client = AsyncIOMotorClient(
+                    mongodb_uri,
+                    maxPoolSize=50,
+                    minPoolSize=10,
+                    serverSelectionTimeoutMS=3000,
+                    socketTimeoutMS=5000,
+                    retryWrites=True,
+                    compressors="zstd"
+                )
+                db = self._client[database_name]
                 self._collection = db["conversations"]
                 self._modes_collection = db["chat_modes"]
-
-                self._collection.create_index("thread_id", unique=True)
-                self._modes_collection.create_index("chat_id", unique=True)
-
-                self._load_from_db()
-                logger.info("MemoryManager: MongoDB persistence enabled")
             except Exception as e:
                 logger.warning(f"MemoryManager: MongoDB init failed, using in-memory only: {e}")
 
-    def _load_from_db(self):
+    async def initialize(self):
+        """Create indexes and load persisted state. Must run on the bot's event loop."""
         if self._collection is None:
             return
 
-        for doc in self._collection.find():
-            thread_id = doc["thread_id"]
-            self._conversations[thread_id] = ConversationState(
-                history=doc.get("history", []),
-                msg_ids_to_delete=doc.get("msg_ids_to_delete", [])
-            )
+        try:
+            # Opens the first pooled connections before the first user write
+            await self._client.admin.command("ping")
+            await self._collection.create_index("thread_id", unique=True)
+            await self._modes_collection.create_index("chat_id", unique=True)
 
-        if self._modes_collection is not None:
-            for doc in self._modes_collection.find():
-                chat_id = doc["chat_id"]
-                mode_str = doc.get("mode", "journal")
-                self._chat_modes[chat_id] = ChatMode(mode_str)
+            await self._load_from_db()
+            self._conversations = _ConversationCache(CONVERSATION_CACHE_SIZE, self._on_evict)
+            self._flush_task = asyncio.create_task(self._flush_loop())
+            logger.info("MemoryManager: MongoDB persistence enabled")
+        except Exception as e:
+            logger.warning(f"MemoryManager: MongoDB init failed, using in-memory only: {e}")
+            self._collection = None
+            self._modes_collection = None
 
-        logger.info(f"Loaded {len(self._conversations)} conversations, {len(self._chat_modes)} chat modes")
+    async def _load_from_db(self):
+        if self._modes_collection is None:
+            return
 
-    def _persist_conversation(self, thread_id: int):
-        if self._collection is None or thread_id not in self._conversations:
+        async for doc in self._modes_collection.find(
+            {}, projection={"_id": 0, "chat_id": 1, "mode": 1}, batch_size=1000
+        ):
+            chat_id = doc["chat_id"]
+            mode_str = doc.get("mode", "journal")
+            self._chat_modes[chat_id] = ChatMode(mode_str)
+
+        logger.info(f"Loaded {len(self._chat_modes)} chat modes")
+
+        async for doc in self._collection.find(
+            {}, projection={"_id": 0, "thread_id": 1}, batch_size=1000
+        ):
+            self._active_threads.add(doc["thread_id"])
+
+        logger.info(f"Found {len(self._active_threads)} active conversations")
+
+    async def _load_conversation(self, thread_id: int) -> Optional[ConversationState]:
+        conv = self._evicted.get(thread_id)
+        if conv is None and self._collection is not None and thread_id in self._active_threads:
+            doc = await self._collection.find_one({"thread_id": thread_id}, projection=_CONVERSATION_PROJECTION)
+            # Another coroutine may have loaded or started it while we waited
+            if thread_id in self._conversations:
+                return self._conversations[thread_id]
+            # ...or ended it, in which case the fetched document is stale
+            if thread_id not in self._active_threads:
+                return None
+            if doc is not None:
+                conv = ConversationState(
+                    history=doc.get("history", []),
+                    msg_ids_to_delete=set(doc.get("msg_ids_to_delete", []))
+                )
+
+        if conv is not None:
+            self._conversations[thread_id] = conv
+        return conv
+
+    def _cached(self, thread_id: int) -> Optional[ConversationState]:
+        conv = self._conversations.get(thread_id)
+        if conv is None:
+            conv = self._evicted.get(thread_id)
+        return conv
+
+    def _on_evict(self, thread_id: int, conv: ConversationState):
+        self._evicted[thread_id] = conv
+        task = asyncio.get_running_loop().create_task(self._persist_evicted(thread_id, conv))
+        self._eviction_tasks.add(task)
+        task.add_done_callback(self._eviction_tasks.discard)
+
+    async def _persist_evicted(self, thread_id: int, conv: ConversationState):
+        async with self._flush_lock:
+            # Skip if the conversation ended, or was evicted again and a newer task owns it
+            if self._evicted.get(thread_id) is not conv:
+                return
+            try:
+                self._discard_pending(thread_id)
+                await self._persist_conversation(thread_id, conv)
+            except Exception as e:
+                logger.error(f"MemoryManager: failed to persist evicted conversation {thread_id}: {e}")
+            finally:
+                if self._evicted.get(thread_id) is conv:
+                    del self._evicted[thread_id]
+
+    async def _persist_conversation(self, thread_id: int, conv: ConversationState):
+        if self._collection is None:
             return
 
-        conv = self._conversations[thread_id]
-        self._collection.update_one(
+        # Snapshot now: anything appended after this point goes through the write-behind buffer
+        await self._collection.update_one(
             {"thread_id": thread_id},
             {"$set": {
                 "thread_id": thread_id,
-                "history": conv.history,
-                "msg_ids_to_delete": conv.msg_ids_to_delete
+                "history": list(conv.history),
+                "msg_ids_to_delete": list(conv.msg_ids_to_delete)
             }},
             upsert=True
         )
 
-    def _persist_chat_mode(self, chat_id: int):
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        """Push buffered messages and deletion ids to MongoDB in one bulk write."""
+        if self._collection is None or not self._dirty:
+            return
+
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError
+
+        async with self._flush_lock:
+            dirty, self._dirty = self._dirty, set()
+            rewrite, self._needs_rewrite = self._needs_rewrite, set()
+            batch = {
+                thread_id: (self._pending_messages.pop(thread_id, []), self._pending_deletions.pop(thread_id, []))
+                for thread_id in dirty
+            }
+
+            ops = []
+            op_threads = []
+            for thread_id, (messages, msg_ids) in batch.items():
+                conv = self._cached(thread_id) if thread_id in rewrite else None
+                if conv is not None:
+                    # A previous write may or may not have landed; $set the whole state instead of pushing
+                    ops.append(UpdateOne({"thread_id": thread_id}, {"$set": {
+                        "thread_id": thread_id,
+                        "history": list(conv.history),
+                        "msg_ids_to_delete": list(conv.msg_ids_to_delete)
+                    }}, upsert=True))
+                    op_threads.append(thread_id)
+                    continue
+
+                update = {}
+                if messages:
+                    update["$push"] = {"history": {"$each": messages}}
+                if msg_ids:
+                    update["$addToSet"] = {"msg_ids_to_delete": {"$each": msg_ids}}
+                if update:
+                    ops.append(UpdateOne({"thread_id": thread_id}, update, upsert=True))
+                    op_threads.append(thread_id)
+
+            if not ops:
+                return
+
+            try:
+                await self._collection.bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                # Unordered: only the reported ops failed, the rest were applied
+                failed = {op_threads[err["index"]] for err in e.details.get("writeErrors", [])}
+                logger.error(f"MemoryManager: {len(failed)} of {len(ops)} flush writes failed, will retry: {e}")
+                for thread_id in failed:
+                    if thread_id in rewrite:
+                        self._mark_for_rewrite(thread_id)
+                    else:
+                        self._requeue(thread_id, *batch[thread_id])
+            except Exception as e:
+                # Outcome unknown (e.g. a timeout): $push is not idempotent, so rewrite instead
+                logger.error(f"MemoryManager: flush failed, will rewrite affected conversations: {e}")
+                for thread_id in op_threads:
+                    self._mark_for_rewrite(thread_id)
+
+    def _requeue(self, thread_id: int, messages: List[Dict[str, str]], msg_ids: List[int]):
+        if self._cached(thread_id) is None:
+            return
+        self._pending_messages[thread_id] = messages + self._pending_messages.get(thread_id, [])
+        self._pending_deletions[thread_id] = msg_ids + self._pending_deletions.get(thread_id, [])
+        self._dirty.add(thread_id)
+
+    def _mark_for_rewrite(self, thread_id: int):
+        if self._cached(thread_id) is None:
+            return
+        self._needs_rewrite.add(thread_id)
+        self._dirty.add(thread_id)
+
+    async def close(self):
+        """Stop the background flusher and write out anything still buffered."""
+        if self._flush_task is not None:
+            # Cancel only between flushes: a flush cancelled mid-write would lose its batch
+            async with self._flush_lock:
+                self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await asyncio.gather(*self._compaction_tasks, return_exceptions=True)
+        await asyncio.gather(*self._eviction_tasks)
+        await self.flush()
+
+    def _discard_pending(self, thread_id: int):
+        self._pending_messages.pop(thread_id, None)
+        self._pending_deletions.pop(thread_id, None)
+        self._needs_rewrite.discard(thread_id)
+        self._dirty.discard(thread_id)
+
+    async def _persist_chat_mode(self, chat_id: int):
         if self._modes_collection is None or chat_id not in self._chat_modes:
             return
 
-        self._modes_collection.update_one(
+        await self._modes_collection.update_one(
             {"chat_id": chat_id},
             {"$set": {
                 "chat_id": chat_id,
@@ -83,39 +299,109 @@ class MemoryManager:
             upsert=True
         )
 
-    def set_chat_mode(self, chat_id: int, mode: ChatMode):
+    async def set_chat_mode(self, chat_id: int, mode: ChatMode):
         self._chat_modes[chat_id] = mode
-        self._persist_chat_mode(chat_id)
+        await self._persist_chat_mode(chat_id)
 
     def get_chat_mode(self, chat_id: int) -> ChatMode:
         return self._chat_modes.get(chat_id, ChatMode.JOURNAL)
 
-    def start_conversation(self, thread_id: int, initial_history: List[Dict[str, str]]):
-        self._conversations[thread_id] = ConversationState(history=initial_history)
-        self._persist_conversation(thread_id)
+    async def start_conversation(self, thread_id: int, initial_history: List[Dict[str, str]]):
+        conv = ConversationState(history=initial_history)
+        self._active_threads.add(thread_id)
+        self._evicted.pop(thread_id, None)
+        self._conversations[thread_id] = conv
+        self._discard_pending(thread_id)
+        await self._persist_conversation(thread_id, conv)
 
-    def get_conversation(self, thread_id: int) -> Optional[ConversationState]:
-        return self._conversations.get(thread_id)
+    def lock(self, thread_id: int) -> asyncio.Lock:
+        """Lock serializing conversation turns within one thread."""
+        return self._locks.setdefault(thread_id, asyncio.Lock())
 
-    def add_message(self, thread_id: int, role: str, content: str):
-        if thread_id in self._conversations:
-            self._conversations[thread_id].history.append({"role": role, "content": content})
-            self._persist_conversation(thread_id)
+    async def get_conversation(self, thread_id: int) -> Optional[ConversationState]:
+        conv = self._conversations.get(thread_id)
+        if conv is None:
+            conv = await self._load_conversation(thread_id)
+        return conv
+
+    async def add_message(self, thread_id: int, role: str, content: str):
+        conv = await self.get_conversation(thread_id)
+        if conv is not None:
+            message = {"role": role, "content": content}
+            conv.history.append(message)
+            if self._collection is not None:
+                self._pending_messages.setdefault(thread_id, []).append(message)
+                self._dirty.add(thread_id)
+
+            if len(conv.history) > MAX_TURNS + 1:
+                self._schedule_compaction(thread_id)
+
+    def _schedule_compaction(self, thread_id: int):
+        # The summarizer is an LLM call; run it off the turn so replies are not delayed
+        if self._summarizer is None or thread_id in self._compacting:
+            return
+
+        self._compacting.add(thread_id)
+        task = asyncio.get_running_loop().create_task(self._compact_history(thread_id))
+        self._compaction_tasks.add(task)
+        task.add_done_callback(self._compaction_tasks.discard)
+
+    async def _compact_history(self, thread_id: int):
+        """Replace everything between the system prompt and the last COMPACT_KEEP messages with a summary."""
+        try:
+            conv = self._cached(thread_id)
+            if conv is None:
+                return
+            history = conv.history
+            # Messages are only ever appended, so this index stays valid across the await
+            cut = len(history) - COMPACT_KEEP
+            try:
+                summary = await self._summarizer(history[1:cut])
+            except Exception as e:
+                logger.warning(f"MemoryManager: history summarization failed: {e}")
+                return
+
+            if self._cached(thread_id) is not conv:
+                return
+            # Copy-on-write: a request already built from the old list keeps seeing it unchanged
+            summary_msg = {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+            conv.history = [history[0], summary_msg, *history[cut:]]
+
+            if self._collection is not None:
+                # The history was rewritten, so replace the stored document instead of pushing
+                async with self._flush_lock:
+                    self._discard_pending(thread_id)
+                    try:
+                        await self._persist_conversation(thread_id, conv)
+                    except Exception as e:
+                        logger.error(f"MemoryManager: failed to persist compacted conversation {thread_id}: {e}")
+        finally:
+            self._compacting.discard(thread_id)
 
     def mark_message_for_deletion(self, thread_id: int, message_id: int):
-        if thread_id in self._conversations:
-            self._conversations[thread_id].msg_ids_to_delete.append(message_id)
+        conv = self._cached(thread_id)
+        if conv is not None and message_id not in conv.msg_ids_to_delete:
+            conv.msg_ids_to_delete.add(message_id)
+            if self._collection is not None:
+                self._pending_deletions.setdefault(thread_id, []).append(message_id)
+                self._dirty.add(thread_id)
 
-    def get_messages_to_delete(self, thread_id: int) -> List[int]:
-        if thread_id in self._conversations:
-            return self._conversations[thread_id].msg_ids_to_delete
+    async def get_messages_to_delete(self, thread_id: int) -> List[int]:
+        conv = await self.get_conversation(thread_id)
+        if conv is not None:
+            return list(conv.msg_ids_to_delete)
         return []
 
-    def end_conversation(self, thread_id: int):
-        if thread_id in self._conversations:
-            del self._conversations[thread_id]
-            if self._collection is not None:
-                self._collection.delete_one({"thread_id": thread_id})
+    async def end_conversation(self, thread_id: int):
+        self._locks.pop(thread_id, None)
+        self._active_threads.discard(thread_id)
+        self._conversations.pop(thread_id, None)
+        self._evicted.pop(thread_id, None)
+        self._discard_pending(thread_id)
+        if self._collection is not None:
+            # Hold the flush lock so an in-flight $push cannot re-create the document
+            async with self._flush_lock:
+                await self._collection.delete_one({"thread_id": thread_id})
 
-    def is_conversation_active(self, thread_id: int) -> bool:
-        return thread_id in self._conversations
+    async def is_conversation_active(self, thread_id: int) -> bool:
+        return await self.get_conversation(thread_id) is not None
@@ -2,7 +2,6 @@
 
 from __future__ import annotations
 
-import asyncio
 import logging
 from typing import TYPE_CHECKING
 
@@ -50,8 +49,10 @@ class MessageLoggerHandlers:
             return
 
         # Automatically activate chat if not already activated
-        chat_title = update.message.chat.title or "Private Chat"
-        self.db.activate_chat(update.message.chat_id, chat_title)
+        if not self.db.is_chat_activated(update.message.chat_id):
+            await self.db.activate_chat(
+                update.message.chat_id, update.message.chat.title or "Private Chat"
+            )
 
         try:
             # Convert the Telegram message object to a dictionary
@@ -60,12 +61,13 @@ class MessageLoggerHandlers:
             # Add chat_id at root level for easier indexing
             message_data["chat_id"] = update.message.chat_id
 
-            # Add user info at root level for easier querying
-            if update.message.from_user:
-                message_data["from_user"] = update.message.from_user.to_dict()
+            # Add user info at root level for easier querying; to_dict()
+            # already serialized the sender under Telegram's "from" key
+            if "from" in message_data:
+                message_data["from_user"] = message_data["from"]
 
-            # Save to MongoDB (run in thread to avoid blocking event loop)
-            success = await asyncio.to_thread(self.db.save_message, message_data)
+            # Save to MongoDB
+            success = await self.db.save_message(message_data)
 
             if success:
                 user_name = (
@@ -90,17 +92,19 @@ class MessageLoggerHandlers:
             return
 
         # Automatically activate chat if not already activated
-        chat_title = update.edited_message.chat.title or "Private Chat"
-        self.db.activate_chat(update.edited_message.chat_id, chat_title)
+        if not self.db.is_chat_activated(update.edited_message.chat_id):
+            await self.db.activate_chat(
+                update.edited_message.chat_id, update.edited_message.chat.title or "Private Chat"
+            )
 
         try:
             message_data = update.edited_message.to_dict()
             message_data["chat_id"] = update.edited_message.chat_id
 
-            if update.edited_message.from_user:
-                message_data["from_user"] = update.edited_message.from_user.to_dict()
+            if "from" in message_data:
+                message_data["from_user"] = message_data["from"]
 
-            success = await asyncio.to_thread(self.db.save_edited_message, message_data)
+            success = await self.db.save_edited_message(message_data)
 
             if success:
                 user_name = (
@@ -124,15 +128,17 @@ class MessageLoggerHandlers:
             return
 
         # Automatically activate chat if not already activated
-        chat_title = update.channel_post.chat.title or "Unknown Channel"
-        self.db.activate_chat(update.channel_post.chat_id, chat_title)
+        if not self.db.is_chat_activated(update.channel_post.chat_id):
+            await self.db.activate_chat(
+                update.channel_post.chat_id, update.channel_post.chat.title or "Unknown Channel"
+            )
 
         try:
             message_data = update.channel_post.to_dict()
             message_data["chat_id"] = update.channel_post.chat_id
             message_data["is_channel_post"] = True
 
-            success = await asyncio.to_thread(self.db.save_message, message_data)
+            success = await self.db.save_message(message_data)
 
             if success:
                 channel_title = update.channel_post.chat.title or "Unknown Channel"
@@ -156,20 +162,16 @@ class MessageLoggerHandlers:
             return
 
         try:
-            chat_id = update.message.chat_id
-            total_messages = await asyncio.to_thread(self.db.get_message_count)
-            chat_messages = await asyncio.to_thread(self.db.get_message_count, chat_id)
-            total_events = await asyncio.to_thread(self.db.get_event_count)
-            chat_events = await asyncio.to_thread(self.db.get_event_count, chat_id)
+            counts = await self.db.get_counts(update.message.chat_id)
 
             await update.message.reply_text(
                 f"Message Logger Stats:\n"
                 f"This chat:\n"
-                f"  - Messages: {chat_messages:,}\n"
-                f"  - Events: {chat_events:,}\n"
+                f"  - Messages: {counts['chat_messages']:,}\n"
+                f"  - Events: {counts['chat_events']:,}\n"
                 f"Total:\n"
-                f"  - Messages: {total_messages:,}\n"
-                f"  - Events: {total_events:,}"
+                f"  - Messages: {counts['total_messages']:,}\n"
+                f"  - Events: {counts['total_events']:,}"
             )
 
         except Exception as e:
@@ -202,9 +204,7 @@ class MessageLoggerHandlers:
         try:
             # Generate topic title
             if self.ai_service:
-                topic_title = await asyncio.to_thread(
-                    self.ai_service.generate_topic_title, user_message
-                )
+                topic_title = await self.ai_service.generate_topic_title(user_message)
             else:
                 # Fallback to truncation if no AI service
                 topic_title = (
@@ -253,24 +253,15 @@ class MessageLoggerHandlers:
 
         try:
             chat_id = update.message.chat_id
-            messages = await asyncio.to_thread(
-                self.db.get_messages_by_topic, chat_id, thread_id
-            )
+            messages = await self.db.get_topic_preview(chat_id, thread_id)
 
             if not messages:
                 await update.message.reply_text("No messages found for this topic.")
                 return
 
-            # Format conversation
+            # Format conversation; previews arrive already truncated
             lines = [f"Topic Conversation ({len(messages)} messages):\n"]
-            for msg in messages:
-                user = msg.get("from_user", {})
-                name = user.get("first_name", "Unknown")
-                text = msg.get("text") or msg.get("caption") or "[media]"
-                # Truncate long messages
-                if len(text) > 100:
-                    text = text[:100] + "..."
-                lines.append(f"• {name}: {text}")
+            lines.extend(f"• {msg['name']}: {msg['preview']}" for msg in messages)
 
             response = "\n".join(lines)
 
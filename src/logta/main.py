@@ -7,11 +7,13 @@ IMPORTANT: You must disable "Group Privacy" mode in @BotFather settings
 for this bot to receive all messages in groups.
 """
 
+import asyncio
 import logging
 import sys
 
 from telegram import Update
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
@@ -36,13 +38,19 @@ logger = logging.getLogger(__name__)
 async def log_all_updates(update: Update, context):
     """Debug handler to log all updates."""
     if update.message:
-        logger.info(f"DEBUG: Received message: {update.message.text or '[Non-text msg]'} from {update.message.from_user.first_name}")
+        logger.debug(f"Received message: {update.message.text or '[Non-text msg]'} from {update.message.from_user.first_name}")
     else:
-        logger.info(f"DEBUG: Received update: {update}")
+        logger.debug(f"Received update: {update}")
 
 
 def main() -> None:
     """Initialize and run the message logger bot."""
+    # uvloop is POSIX-only; run_polling picks up the policy's loop
+    if sys.platform != "win32":
+        import uvloop
+
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
     # Load configuration
     try:
         config = LoggerConfig.from_env()
@@ -57,9 +65,6 @@ def main() -> None:
             uri=config.mongodb_uri,
             database_name=config.database_name,
         )
-        logger.info(
-            f"Connected to MongoDB: {config.database_name} (messages + events collections)"
-        )
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {e}")
         sys.exit(1)
@@ -83,11 +88,36 @@ def main() -> None:
         ai_service=ai_service,
     )
 
+    async def post_init(application: Application) -> None:
+        # Motor must be used from the loop the bot runs on
+        await mongodb_service.initialize()
+        logger.info(
+            f"Connected to MongoDB: {config.database_name} (messages + events collections)"
+        )
+
+    async def post_shutdown(application: Application) -> None:
+        # Drain buffered writes while the event loop is still running
+        await mongodb_service.flush()
+        mongodb_service.close()
+
     # Build the Telegram application
-    application = ApplicationBuilder().token(config.telegram_token).build()
+    application = (
+        ApplicationBuilder()
+        .token(config.telegram_token)
+        # Handle updates in parallel and size the HTTP pools to match
+        .concurrent_updates(256)
+        .connection_pool_size(256)
+        .pool_timeout(10.0)
+        .get_updates_connection_pool_size(32)
+        .get_updates_pool_timeout(10.0)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
-    # Debug: Log all updates
-    application.add_handler(TypeHandler(Update, log_all_updates), group=-1)
+    # Debug: Log all updates; skipped otherwise so production pays no extra dispatch
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        application.add_handler(TypeHandler(Update, log_all_updates), group=-1)
 
     # Register handlers
 
@@ -136,8 +166,6 @@ def main() -> None:
         application.run_polling(allowed_updates=["message", "edited_message", "channel_post"])
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
-    finally:
-        mongodb_service.close()
 
 
 if __name__ == "__main__":
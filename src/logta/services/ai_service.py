@@ -1,7 +1,9 @@
 """AI service for generating topic titles."""
 
 import logging
-from openai import OpenAI
+
+from cachetools import LRUCache
+from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
 
@@ -9,39 +11,66 @@ TITLE_PROMPT = """Generate a concise topic title (max 60 characters) for a forum
 Return ONLY the title, nothing else. No quotes, no explanation.
 The title should capture the main subject or question."""
 
+# Generated titles kept for repeated /topic prompts
+TITLE_CACHE_SIZE = 1024
+
+# Longer prompts are not cached: a prefix key could map different prompts together
+TITLE_CACHE_MAX_LENGTH = 200
+
 
 class AIService:
     """Service for AI-powered features like title generation."""
 
     def __init__(self, api_key: str, base_url: str, model_name: str):
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url)
         self.model_name = model_name
 
-    def generate_topic_title(self, message: str) -> str:
+        self._title_cache: LRUCache[str, str] = LRUCache(maxsize=TITLE_CACHE_SIZE)
+
+    async def generate_topic_title(self, message: str) -> str:
         """Generate a concise topic title from a message.
 
+        Titles for short prompts are cached by their normalized text, so
+        repeating a prompt does not call the model again. Fallback titles
+        are never cached.
+
         Args:
             message: The user's message to base the title on
 
         Returns:
             A concise topic title (max 60 chars)
         """
+        key = message.strip().lower()
+        cacheable = 0 < len(key) <= TITLE_CACHE_MAX_LENGTH
+        if cacheable:
+            title = self._title_cache.get(key)
+            if title is not None:
+                return title
+
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": TITLE_PROMPT},
-                    {"role": "user", "content": message},
-                ],
-                max_tokens=50,
-                temperature=0.3,
-            )
-            title = response.choices[0].message.content.strip()
-            # Ensure max length
-            if len(title) > 60:
-                title = title[:57] + "..."
-            return title
+            title = await self._request_title(message)
         except Exception as e:
             logger.error(f"AI title generation failed: {e}")
             # Fallback to truncation
             return (message[:57] + "...") if len(message) > 60 else message
+
+        if cacheable:
+            self._title_cache[key] = title
+        return title
+
+    async def _request_title(self, message: str) -> str:
+        """Ask the model for a title, trimmed to 60 characters."""
+        response = await self.client.chat.completions.create(
+            model=self.model_name,
+            messages=[
+                {"role": "system", "content": TITLE_PROMPT},
+                {"role": "user", "content": message},
+            ],
+            max_tokens=50,
+            temperature=0.3,
+        )
+        title = response.choices[0].message.content.strip()
+        # Ensure max length
+        if len(title) > 60:
+            title = title[:57] + "..."
+        return title
@@ -1,18 +1,39 @@
 """MongoDB service for storing Telegram messages."""
 
+import asyncio
 import logging
 from datetime import datetime, timezone
+from itertools import groupby
 from typing import Any
 
-from pymongo import MongoClient
-from pymongo.collection import Collection
-from pymongo.database import Database
+from cachetools import LRUCache
+from motor.motor_asyncio import (
+    AsyncIOMotorClient,
+    AsyncIOMotorCollection,
+    AsyncIOMotorDatabase,
+)
+from pymongo import DeleteOne, InsertOne, UpdateOne, WriteConcern
+from pymongo.errors import BulkWriteError
 
 logger = logging.getLogger(__name__)
 
+# Operations accepted by the write-behind buffer
+WriteOp = InsertOne | UpdateOne | DeleteOne
+
+# Queued write: target collection, operation and, for inserts, the original document
+WriteEntry = tuple[AsyncIOMotorCollection, WriteOp, dict[str, Any] | None]
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Upper bound on concurrent MongoDB operations; Motor queues the rest
+MAX_POOL_SIZE = 100
+
+# Activated chat IDs kept in memory; older ones are re-checked against MongoDB
+ACTIVATED_CHAT_CACHE_SIZE = 10_000
+
 
 # Event fields that indicate a system event rather than user content
-EVENT_FIELDS = {
+EVENT_FIELDS: frozenset[str] = frozenset({
     "new_chat_member",
     "new_chat_members",
     "left_chat_member",
@@ -27,7 +48,7 @@ EVENT_FIELDS = {
     "migrate_to_chat_id",
     "migrate_from_chat_id",
     "pinned_message",
-}
+})
 
 
 class MongoDBService:
@@ -40,100 +61,242 @@ class MongoDBService:
     ):
         """Initialize MongoDB connection.
 
+        The client connects lazily; call :meth:`initialize` on the bot's
+        event loop before handling updates.
+
         Args:
             uri: MongoDB connection URI
             database_name: Name of the database
         """
-        self.client: MongoClient = MongoClient(uri)
-        self.db: Database = self.client[database_name]
-        self.messages: Collection = self.db["messages"]
-        self.events: Collection = self.db["events"]
-        self.activated_chats: Collection = self.db["activated_chats"]
+        # Message documents are verbose JSON-like BSON and compress well;
+        # the server picks the first compressor it also supports
+        self.client: AsyncIOMotorClient = AsyncIOMotorClient(
+            uri, maxPoolSize=MAX_POOL_SIZE, compressors="zstd,zlib"
+        )
+        self.db: AsyncIOMotorDatabase = self.client[database_name]
+        self.messages: AsyncIOMotorCollection = self.db["messages"]
+        self.events: AsyncIOMotorCollection = self.db["events"]
+        # System events tolerate loss, so they are written without acknowledgement
+        self.events_unack: AsyncIOMotorCollection = self.db.get_collection(
+            "events", write_concern=WriteConcern(w=0)
+        )
+        self.activated_chats: AsyncIOMotorCollection = self.db["activated_chats"]
 
-        # Load activated chats into memory for fast lookup
-        self._activated_chat_ids: set[int] = set()
-        self._load_activated_chats()
+        # Bounded cache of chats known to be active; a miss only means "unknown"
+        self._activated_chat_ids: LRUCache[int, bool] = LRUCache(
+            maxsize=ACTIVATED_CHAT_CACHE_SIZE
+        )
+
+        # Write-behind buffer: saves are queued and drained in bulk
+        self._buffered_msg_count = 50
+        self._idle_flush_ms = 200
+        self._max_pending = 10_000
+        self._write_queue: asyncio.Queue = asyncio.Queue(maxsize=self._max_pending)
+        self._flush_task: asyncio.Task | None = None
 
+    async def initialize(self) -> None:
+        """Create indexes, load activated chats and start the write flusher."""
         # Create indexes for efficient querying
-        self._create_indexes()
+        await self._create_indexes()
+
+        # Load activated chats into memory for fast lookup
+        await self._load_activated_chats()
+
+        self._flush_task = asyncio.create_task(self._drain_writes())
+
+    async def _drain_writes(self) -> None:
+        """Collect queued writes into batches and flush each with one bulk_write."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._write_queue.get()]
+            deadline = loop.time() + self._idle_flush_ms / 1000
+            try:
+                while len(batch) < self._buffered_msg_count:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(
+                            await asyncio.wait_for(self._write_queue.get(), timeout)
+                        )
+                    except asyncio.TimeoutError:
+                        break
+                await self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._write_queue.task_done()
+
+    async def _write_batch(self, batch: list[WriteEntry]) -> None:
+        """Write a batch of queued operations in queue order.
+
+        Consecutive inserts are written unordered; updates and deletes are
+        written ordered and only after the inserts queued before them, so an
+        edit never lands ahead of the message it edits.
+        """
+        for is_insert, run in groupby(
+            batch, key=lambda entry: isinstance(entry[1], InsertOne)
+        ):
+            await self._write_run(list(run), ordered=not is_insert)
+
+    async def _write_run(self, run: list[WriteEntry], ordered: bool) -> None:
+        """Write a run of queued operations, one bulk_write per collection."""
+        # Keyed by handle identity: handles with different write concerns compare equal
+        grouped: dict[
+            int,
+            tuple[AsyncIOMotorCollection, list[WriteOp], list[dict[str, Any] | None]],
+        ] = {}
+        for collection, op, doc in run:
+            _, ops, docs = grouped.setdefault(id(collection), (collection, [], []))
+            ops.append(op)
+            docs.append(doc)
+
+        for collection, ops, docs in grouped.values():
+            try:
+                try:
+                    await collection.bulk_write(ops, ordered=ordered)
+                except BulkWriteError as e:
+                    # Unordered: every other insert went through. Re-save the
+                    # duplicates (redelivered updates) with the upsert path.
+                    retries = self._duplicate_upserts(docs, e)
+                    if not retries:
+                        raise
+                    await collection.bulk_write(retries, ordered=False)
+                logger.debug(f"Flushed {len(ops)} writes to {collection.name}")
+            except Exception as e:
+                logger.error(f"Failed to flush {len(ops)} writes to {collection.name}: {e}")
+
+    @staticmethod
+    def _duplicate_upserts(
+        docs: list[dict[str, Any] | None], error: BulkWriteError
+    ) -> list[UpdateOne]:
+        """Turn inserts rejected as duplicates into upserts of their original documents."""
+        retries = []
+        for write_error in error.details.get("writeErrors", []):
+            doc = docs[write_error["index"]]
+            if write_error.get("code") != DUPLICATE_KEY_ERROR or doc is None:
+                logger.error(f"Buffered write failed: {write_error.get('errmsg')}")
+                continue
+            retries.append(
+                UpdateOne(
+                    {"message_id": doc["message_id"], "chat_id": doc["chat_id"]},
+                    {"$set": doc},
+                    upsert=True,
+                )
+            )
+        return retries
 
-    def _create_indexes(self) -> None:
+    async def flush(self) -> None:
+        """Wait until every queued write has been sent to MongoDB.
+
+        This waits for all traffic, so it is meant for shutdown; writes that
+        depend on earlier ones rely on the queue's order instead.
+        """
+        await self._write_queue.join()
+
+    wait_for_pending = flush
+
+    async def _create_indexes(self) -> None:
         """Create indexes for efficient querying."""
         # Indexes for messages collection
-        self.messages.create_index(
+        await self.messages.create_index(
             [("message_id", 1), ("chat_id", 1)],
             unique=True,
             name="message_chat_unique",
         )
-        self.messages.create_index("chat_id", name="chat_id_idx")
-        self.messages.create_index("date", name="date_idx")
-        self.messages.create_index("from_user.id", name="user_id_idx")
-        self.messages.create_index("message_thread_id", name="thread_id_idx")
+        # Serves topic history with its sort; chat_id-only queries use the prefix
+        await self.messages.create_index(
+            [("chat_id", 1), ("message_thread_id", 1), ("date", 1)],
+            name="chat_thread_date_idx",
+        )
+        await self.messages.create_index("date", name="date_idx")
+        await self.messages.create_index("from_user.id", name="user_id_idx")
 
         # Indexes for events collection
-        self.events.create_index(
+        await self.events.create_index(
             [("message_id", 1), ("chat_id", 1)],
             unique=True,
             name="event_chat_unique",
         )
-        self.events.create_index("chat_id", name="chat_id_idx")
-        self.events.create_index("date", name="date_idx")
+        await self.events.create_index("chat_id", name="chat_id_idx")
+        await self.events.create_index("date", name="date_idx")
 
         logger.info("MongoDB indexes created for messages and events collections")
 
-    def _load_activated_chats(self) -> None:
-        """Load activated chat IDs from database into memory."""
+    async def _load_activated_chats(self) -> None:
+        """Warm the activated chats cache from the database."""
         try:
-            chats = self.activated_chats.find({}, {"chat_id": 1})
-            self._activated_chat_ids = {doc["chat_id"] for doc in chats}
+            # Skip _id and fetch the whole warm-up set in one batch
+            chats = self.activated_chats.find(
+                {},
+                {"chat_id": 1, "_id": 0},
+                limit=ACTIVATED_CHAT_CACHE_SIZE,
+                batch_size=ACTIVATED_CHAT_CACHE_SIZE,
+            )
+            async for doc in chats:
+                self._activated_chat_ids[doc["chat_id"]] = True
             logger.info(f"Loaded {len(self._activated_chat_ids)} activated chats")
         except Exception as e:
             logger.error(f"Failed to load activated chats: {e}")
 
     def is_chat_activated(self, chat_id: int) -> bool:
-        """Check if a chat is activated for logging."""
-        return chat_id in self._activated_chat_ids
+        """Check if a chat is known to be activated for logging.
 
-    def activate_chat(self, chat_id: int, chat_title: str) -> bool:
+        Only the cache is consulted, so a chat evicted from it reports
+        False until :meth:`activate_chat` sees it again.
+        """
+        return self._activated_chat_ids.get(chat_id, False)
+
+    async def activate_chat(self, chat_id: int, chat_title: str) -> bool:
         """Activate a chat for logging.
 
+        The chat counts as active immediately; the upsert is written by the
+        write-behind buffer.
+
         Returns:
-            True if newly activated, False if already active
+            True if the activation was queued, False if already active
         """
-        if chat_id in self._activated_chat_ids:
+        if self.is_chat_activated(chat_id):
             return False
 
         try:
-            self.activated_chats.update_one(
-                {"chat_id": chat_id},
-                {
-                    "$set": {
-                        "chat_id": chat_id,
-                        "chat_title": chat_title,
-                        "activated_at": datetime.now(timezone.utc),
-                    }
-                },
-                upsert=True,
+            # Not cached does not mean new: keep the original activation time
+            await self._write_queue.put(
+                (
+                    self.activated_chats,
+                    UpdateOne(
+                        {"chat_id": chat_id},
+                        {
+                            "$set": {"chat_title": chat_title},
+                            "$setOnInsert": {
+                                "activated_at": datetime.now(timezone.utc)
+                            },
+                        },
+                        upsert=True,
+                    ),
+                    None,
+                )
             )
-            self._activated_chat_ids.add(chat_id)
-            logger.info(f"Activated chat: {chat_title} ({chat_id})")
+            self._activated_chat_ids[chat_id] = True
+            logger.debug(f"Queued activation: {chat_title} ({chat_id})")
             return True
         except Exception as e:
             logger.error(f"Failed to activate chat: {e}")
             return False
 
-    def deactivate_chat(self, chat_id: int) -> bool:
+    async def deactivate_chat(self, chat_id: int) -> bool:
         """Deactivate a chat from logging.
 
+        The chat stops counting as active immediately; the delete is queued
+        behind any pending activation of the same chat.
+
         Returns:
-            True if deactivated, False if wasn't active
+            True if the deactivation was queued, False otherwise
         """
-        if chat_id not in self._activated_chat_ids:
-            return False
-
         try:
-            self.activated_chats.delete_one({"chat_id": chat_id})
-            self._activated_chat_ids.discard(chat_id)
+            await self._write_queue.put(
+                (self.activated_chats, DeleteOne({"chat_id": chat_id}), None)
+            )
+            self._activated_chat_ids.pop(chat_id, None)
             logger.info(f"Deactivated chat: {chat_id}")
             return True
         except Exception as e:
@@ -142,9 +305,10 @@ class MongoDBService:
 
     def _is_event(self, message_data: dict[str, Any]) -> bool:
         """Check if the message is a system event."""
-        return any(message_data.get(field) for field in EVENT_FIELDS)
+        # Intersect in C first; only the few present keys need a truthiness check
+        return any(message_data[field] for field in EVENT_FIELDS & message_data.keys())
 
-    def save_message(self, message_data: dict[str, Any]) -> bool:
+    async def save_message(self, message_data: dict[str, Any]) -> bool:
         """Save a message or event to the appropriate MongoDB collection.
 
         Args:
@@ -159,81 +323,98 @@ class MongoDBService:
 
             # Determine which collection to use
             is_event = self._is_event(message_data)
-            collection = self.events if is_event else self.messages
+            # Events go unacknowledged: a redelivered duplicate is dropped
+            # silently instead of upserted, which is fine for system events
+            collection = self.events_unack if is_event else self.messages
             doc_type = "event" if is_event else "message"
 
-            # Use upsert to handle duplicates gracefully
-            result = collection.update_one(
-                {
-                    "message_id": message_data.get("message_id"),
-                    "chat_id": message_data.get("chat_id"),
-                },
-                {"$set": message_data},
-                upsert=True,
+            # Almost every message is new, so insert; duplicates from
+            # redelivery fall back to an upsert when the batch is flushed.
+            # Blocks only when the buffer is full, so producers cannot
+            # outrun MongoDB.
+            # The driver stamps an _id onto the dict it inserts, so it gets a
+            # copy and the original stays clean for the upsert fallback
+            await self._write_queue.put(
+                (collection, InsertOne(dict(message_data)), message_data)
             )
 
-            if result.upserted_id:
-                logger.debug(f"Inserted new {doc_type}: {message_data.get('message_id')}")
-            else:
-                logger.debug(f"Updated existing {doc_type}: {message_data.get('message_id')}")
-
+            logger.debug(f"Queued {doc_type}: {message_data['message_id']}")
             return True
 
         except Exception as e:
             logger.error(f"Failed to save {doc_type}: {e}")
             return False
 
-    def save_edited_message(self, message_data: dict[str, Any]) -> bool:
+    async def save_edited_message(self, message_data: dict[str, Any]) -> bool:
         """Save an edited message, preserving the original.
 
         Args:
             message_data: The edited message data
 
+        The update is queued behind any buffered save of the original, so
+        it is applied after it.
+
         Returns:
-            True if saved successfully, False otherwise
+            True if queued successfully, False otherwise
         """
         try:
             message_id = message_data.get("message_id")
             chat_id = message_data.get("chat_id")
 
-            # Edited messages are always content, use messages collection
-            original = self.messages.find_one(
-                {"message_id": message_id, "chat_id": chat_id}
-            )
-
-            if original:
-                # Initialize edit history if not exists
-                edit_history = original.get("edit_history", [])
-
-                # Add the previous version to history (preserve text or caption edits)
-                if "text" in original or "caption" in original:
-                    edit_history.append(
-                        {
-                            "text": original.get("text"),
-                            "caption": original.get("caption"),
-                            "edited_at": original.get("edit_date") or original.get("logged_at"),
-                        }
-                    )
-
-                message_data["edit_history"] = edit_history
-
             message_data["logged_at"] = datetime.now(timezone.utc)
             message_data["was_edited"] = True
 
-            result = self.messages.update_one(
+            # Edited messages are always content, use messages collection.
+            # One pipeline update archives the previous version (only if it
+            # had text or caption) and applies the edit, so concurrent edits
+            # cannot drop each other's history.
+            edit = UpdateOne(
                 {"message_id": message_id, "chat_id": chat_id},
-                {"$set": message_data},
+                [
+                    {
+                        "$set": {
+                            "edit_history": {
+                                "$cond": [
+                                    {
+                                        "$or": [
+                                            {"$ne": [{"$type": "$text"}, "missing"]},
+                                            {"$ne": [{"$type": "$caption"}, "missing"]},
+                                        ]
+                                    },
+                                    {
+                                        "$concatArrays": [
+                                            {"$ifNull": ["$edit_history", []]},
+                                            [
+                                                {
+                                                    "text": "$text",
+                                                    "caption": "$caption",
+                                                    "edited_at": {
+                                                        "$ifNull": ["$edit_date", "$logged_at"]
+                                                    },
+                                                }
+                                            ],
+                                        ]
+                                    },
+                                    "$edit_history",
+                                ]
+                            }
+                        }
+                    },
+                    # Literal values: message text like "$5" is not a field path
+                    {"$set": {k: {"$literal": v} for k, v in message_data.items()}},
+                ],
                 upsert=True,
             )
+            await self._write_queue.put((self.messages, edit, None))
 
-            logger.debug(f"Saved edited message: {message_id}")
+            logger.debug(f"Queued edited message: {message_id}")
             return True
 
         except Exception as e:
             logger.error(f"Failed to save edited message: {e}")
             return False
 
-    def get_messages_by_chat(
+    async def get_messages_by_chat(
         self, chat_id: int, limit: int = 100, skip: int = 0
     ) -> list[dict[str, Any]]:
         """Retrieve messages for a specific chat.
@@ -252,9 +433,9 @@ class MongoDBService:
             .skip(skip)
             .limit(limit)
         )
-        return list(cursor)
+        return await cursor.to_list(length=limit)
 
-    def get_messages_by_user(
+    async def get_messages_by_user(
         self, user_id: int, limit: int = 100
     ) -> list[dict[str, Any]]:
         """Retrieve messages from a specific user.
@@ -271,9 +452,9 @@ class MongoDBService:
             .sort("date", -1)
             .limit(limit)
         )
-        return list(cursor)
+        return await cursor.to_list(length=limit)
 
-    def get_messages_by_topic(
+    async def get_messages_by_topic(
         self, chat_id: int, thread_id: int, limit: int = 500
     ) -> list[dict[str, Any]]:
         """Retrieve messages from a specific forum topic.
@@ -294,33 +475,115 @@ class MongoDBService:
             .sort("date", 1)
             .limit(limit)
         )
-        return list(cursor)
+        return await cursor.to_list(length=limit)
+
+    async def get_topic_preview(
+        self, chat_id: int, thread_id: int, limit: int = 500
+    ) -> list[dict[str, str]]:
+        """Retrieve one-line previews of the messages in a forum topic.
+
+        Names and truncated text are computed server-side, so only the
+        preview fields cross the wire.
+
+        Args:
+            chat_id: The Telegram chat ID
+            thread_id: The forum topic thread ID
+            limit: Maximum number of messages to return
 
-    def get_message_count(self, chat_id: int | None = None) -> int:
+        Returns:
+            List of {"name", "preview"} dicts sorted by date (oldest first)
+        """
+        content = {"$ifNull": ["$text", {"$ifNull": ["$caption", "[media]"]}]}
+        pipeline = [
+            {"$match": {"chat_id": chat_id, "message_thread_id": thread_id}},
+            {"$sort": {"date": 1}},
+            {"$limit": limit},
+            {
+                "$project": {
+                    "_id": 0,
+                    "name": {"$ifNull": ["$from_user.first_name", "Unknown"]},
+                    # Code points, not bytes, so multi-byte characters stay whole
+                    "preview": {
+                        "$cond": [
+                            {"$gt": [{"$strLenCP": content}, 100]},
+                            {"$concat": [{"$substrCP": [content, 0, 100]}, "..."]},
+                            content,
+                        ]
+                    },
+                }
+            },
+        ]
+        return await self.messages.aggregate(pipeline).to_list(length=limit)
+
+    async def get_message_count(self, chat_id: int | None = None) -> int:
         """Get the total count of logged messages.
 
+        Without a chat ID this reads the collection's metadata count in
+        constant time. That figure can drift after an unclean shutdown
+        and includes orphaned documents on sharded clusters, which is
+        acceptable for statistics; filtered counts are exact.
+
         Args:
             chat_id: Optional chat ID to filter by
 
         Returns:
             Number of messages
         """
-        filter_query = {"chat_id": chat_id} if chat_id else {}
-        return self.messages.count_documents(filter_query)
+        if chat_id is None:
+            return await self.messages.estimated_document_count()
+        return await self.messages.count_documents({"chat_id": chat_id})
 
-    def get_event_count(self, chat_id: int | None = None) -> int:
+    async def get_event_count(self, chat_id: int | None = None) -> int:
         """Get the total count of logged events.
 
+        Like :meth:`get_message_count`, the unfiltered count is an estimate
+        from collection metadata.
+
         Args:
             chat_id: Optional chat ID to filter by
 
         Returns:
             Number of events
         """
-        filter_query = {"chat_id": chat_id} if chat_id else {}
-        return self.events.count_documents(filter_query)
+        if chat_id is None:
+            return await self.events.estimated_document_count()
+        return await self.events.count_documents({"chat_id": chat_id})
+
+    async def get_counts(self, chat_id: int) -> dict[str, int]:
+        """Get message and event counts, overall and for one chat.
+
+        The four counts run concurrently: the totals are metadata
+        estimates and the per-chat counts use the chat_id index.
+
+        Args:
+            chat_id: The chat to count separately
+
+        Returns:
+            Dictionary with total_messages, chat_messages, total_events
+            and chat_events
+        """
+        total_messages, chat_messages, total_events, chat_events = (
+            await asyncio.gather(
+                self.get_message_count(),
+                self.get_message_count(chat_id),
+                self.get_event_count(),
+                self.get_event_count(chat_id),
+            )
+        )
+        return {
+            "total_messages": total_messages,
+            "chat_messages": chat_messages,
+            "total_events": total_events,
+            "chat_events": chat_events,
+        }
 
     def close(self) -> None:
-        """Close the MongoDB connection."""
+        """Stop the write flusher and close the MongoDB connection.
+
+        Call :meth:`flush` first so buffered writes are not lost.
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
         self.client.close()
         logger.info("MongoDB connection closed")